@@ -0,0 +1,240 @@
+import logging
+
+from PIL import Image
+import cv2
+import numpy as np
+from config import (
+    BASE_RATE_PER_CM2, BASE_RATE_PER_CM, MINIMAL_PRICE,
+    COLOR_MIN_SHARE, COLOR_SHARE_WEIGHT, COLOR_PER_COLOR, COLOR_MAX_COLORS, COLOR_MULTIPLIER_MAX
+)
+
+logger = logging.getLogger(__name__)
+
+# Пороги определения типа тату
+FILL_RATIO_FILLED = 0.7  # выше - заполненная (если текстура ровная)
+FILL_RATIO_MIXED = 0.2   # выше - смешанная
+TEXTURE_STD_LIMIT = 30   # разброс яркости внутри контуров
+
+# Оценка цвета
+COLOR_SAMPLE_SIDE = 128        # цвет считаем по копии с такой длинной стороной
+HUE_BINS = 12                  # грубых оттенков по кругу
+SATURATION_MIN = 60            # ниже - серый/черный, а не цвет
+VALUE_MIN = 50                 # темнее - черный
+COLOR_MIN_BIN_SHARE = 0.02     # оттенок с меньшей долей считаем шумом
+
+
+def load_image(source) -> np.ndarray:
+    """Загрузка изображения в RGB, прозрачный фон заменяется белым"""
+    if hasattr(source, 'seek'):
+        source.seek(0)
+    image_pil = Image.open(source)
+
+    # Конвертация прозрачного фона в белый
+    if image_pil.mode in ('RGBA', 'LA', 'P'):
+        image_pil = image_pil.convert('RGBA')
+        white_bg = Image.new('RGB', image_pil.size, (255, 255, 255))
+        white_bg.paste(image_pil, mask=image_pil.split()[3])
+        image_pil = white_bg
+    elif image_pil.mode != 'RGB':
+        image_pil = image_pil.convert('RGB')
+
+    return np.array(image_pil)
+
+
+def measure_pixels(image_np: np.ndarray) -> dict:
+    """Все, что считается по пикселям и не зависит от размера тату
+
+    Площади и периметр - в пикселях, перевод в см делает areas_in_cm.
+    """
+    # Предобработка изображения
+    gray = cv2.cvtColor(image_np, cv2.COLOR_RGB2GRAY)
+    gray = cv2.GaussianBlur(gray, (7, 7), 0)
+
+    # Бинаризация
+    _, th1 = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    th2 = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                                cv2.THRESH_BINARY_INV, 21, 10)
+    binary = cv2.bitwise_or(th1, th2)
+    binary = cv2.morphologyEx(binary, cv2.MORPH_CLOSE, np.ones((3, 3), np.uint8))
+
+    # Нахождение контуров
+    contours, _ = cv2.findContours(binary, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        raise ValueError("Не найдено контуров")
+
+    # При px_per_cm = 1 площади и периметр получаются в пикселях
+    areas_px = improved_calculate_areas(binary, contours, 1.0)
+
+    # Определение типа тату (отношение площадей от масштаба не зависит)
+    tattoo_type = "outline"
+    fill_ratio = None
+    texture_std = None
+    if areas_px['filled'] > 0:
+        fill_ratio = areas_px['filled'] / (areas_px['contour'] + 1e-5)
+        roi_mask = np.zeros_like(gray)
+        cv2.drawContours(roi_mask, contours, -1, 255, cv2.FILLED)
+        texture_std = float(cv2.meanStdDev(gray, mask=roi_mask)[1][0][0])
+
+        if fill_ratio > FILL_RATIO_FILLED and texture_std < TEXTURE_STD_LIMIT:
+            tattoo_type = "filled"
+        elif fill_ratio > FILL_RATIO_MIXED or texture_std > TEXTURE_STD_LIMIT:
+            tattoo_type = "mixed"
+
+    return {
+        'binary': binary,
+        'contours': contours,
+        'height_px': image_np.shape[0],
+        'width_px': image_np.shape[1],
+        'filled_px': float(areas_px['filled']),
+        'contour_px': float(areas_px['contour']),
+        'perimeter_px': float(areas_px['perimeter']),
+        'contours_count': len(contours),
+        'fill_ratio': fill_ratio,
+        'texture_std': texture_std,
+        'tattoo_type': tattoo_type,
+        **measure_colors(image_np, binary)
+    }
+
+
+def measure_colors(image_np: np.ndarray, binary: np.ndarray) -> dict:
+    """Число цветов и доля цветной площади по уменьшенной копии
+
+    Краской считаются пиксели маски binary из measure_pixels - той же, по которой
+    считаются площади. Вместо k-means - гистограмма по грубой сетке HSV:
+    12 оттенков x 2 уровня насыщенности x 2 уровня яркости, одним np.bincount.
+    """
+    height, width = image_np.shape[:2]
+    scale = COLOR_SAMPLE_SIDE / max(height, width)
+    if scale < 1:
+        size = (max(1, int(width * scale)), max(1, int(height * scale)))
+        image_np = cv2.resize(image_np, size, interpolation=cv2.INTER_AREA)
+        binary = cv2.resize(binary, size, interpolation=cv2.INTER_NEAREST)
+
+    hsv = cv2.cvtColor(image_np, cv2.COLOR_RGB2HSV).reshape(-1, 3)
+    hue, saturation, value = hsv[:, 0], hsv[:, 1], hsv[:, 2]
+
+    ink = binary.reshape(-1) > 0
+    colored = ink & (saturation >= SATURATION_MIN) & (value >= VALUE_MIN)
+    ink_count = int(np.count_nonzero(ink))
+    colored_count = int(np.count_nonzero(colored))
+    if not colored_count:
+        return {'colors': 0, 'colored_share': 0.0, 'color_factor': 1.0}
+
+    # Сдвиг на полкорзины, чтобы красный у 0 и у 179 попал в один оттенок (OpenCV: hue 0..179)
+    hue_bin = ((hue[colored].astype(np.int32) + 180 // HUE_BINS // 2) % 180) * HUE_BINS // 180
+    bins = hue_bin * 4 + (saturation[colored] >= 160) * 2 + (value[colored] >= 160)
+    histogram = np.bincount(bins, minlength=HUE_BINS * 4)
+
+    colors = int(np.count_nonzero(histogram >= colored_count * COLOR_MIN_BIN_SHARE))
+    colored_share = colored_count / ink_count
+    return {
+        'colors': colors,
+        'colored_share': colored_share,
+        'color_factor': color_multiplier(colors, colored_share)
+    }
+
+
+def color_multiplier(colors, colored_share):
+    """Коэффициент цены за цвет: доля цветной площади и число цветов"""
+    if colored_share < COLOR_MIN_SHARE:
+        return 1.0
+    factor = 1 + COLOR_SHARE_WEIGHT * colored_share + COLOR_PER_COLOR * (min(colors, COLOR_MAX_COLORS) - 1)
+    return round(min(factor, COLOR_MULTIPLIER_MAX), 3)
+
+
+def load_and_measure(source):
+    """Загрузка и пиксельный анализ одним вызовом (для фонового потока)"""
+    image_np = load_image(source)
+    return image_np, measure_pixels(image_np)
+
+
+def areas_in_cm(metrics: dict, height_cm: float) -> dict:
+    """Перевод пиксельных метрик в см по желаемой высоте тату"""
+    px_per_cm = metrics['height_px'] / height_cm
+    return {
+        'filled': metrics['filled_px'] / (px_per_cm ** 2),
+        'contour': metrics['contour_px'] / (px_per_cm ** 2),
+        'perimeter': metrics['perimeter_px'] / px_per_cm
+    }
+
+
+def improved_calculate_areas(binary_image, contours, px_per_cm):
+    """Расчет площадей и периметра с учетом заливки"""
+    try:
+        # Площадь по залитым пикселям
+        filled_px = np.sum(binary_image == 255)
+        filled_cm2 = filled_px / (px_per_cm ** 2)
+
+        # Площадь по контурам (используем boundingRect для каждого контура)
+        contour_px = sum(w * h for (x, y, w, h) in
+                        [cv2.boundingRect(cnt) for cnt in contours])
+        contour_cm2 = contour_px / (px_per_cm ** 2)
+
+        # Периметр
+        perimeter = sum(cv2.arcLength(cnt, True) for cnt in contours) / px_per_cm
+
+        return {
+            'filled': filled_cm2,
+            'contour': contour_cm2,
+            'perimeter': perimeter
+        }
+    except Exception as e:
+        # logger.error(f"Ошибка расчета площадей: {str(e)}", exc_info=True)
+        return {'filled': 0, 'contour': 0, 'perimeter': 0}
+
+
+def determine_tattoo_type(areas):
+    try:
+        if areas['filled'] < 1.0:  # Совсем маленькие области
+            return 'outline'
+
+        fill_ratio = areas['filled'] / (areas['contour'] + 1e-5)
+
+        if fill_ratio > 0.7:  # Больше заполнения
+            return 'filled'
+        elif fill_ratio > 0.3:  # Среднее заполнение
+            return 'mixed'
+        else:  # Чистые контуры
+            return 'outline'
+    except Exception as e:
+        # logger.error(f"Ошибка определения типа: {e}")
+        return 'outline'  # Значение по умолчанию
+
+
+def calculate_price(filled_area, contour_area, perimeter, contours_count, tattoo_type=None, location_factor=1.0,
+                    color_factor=1.0):
+    """Расчет цены с учетом типа татуировки, местоположения и цвета"""
+    try:
+        # Если тип не указан, определяем автоматически
+        if tattoo_type is None:
+            tattoo_type = determine_tattoo_type({
+                'filled': filled_area,
+                'contour': contour_area
+            })
+
+        # Коэффициент сложности
+        if contours_count < 15:
+            complexity = 0.8
+        elif contours_count < 500:
+            complexity = 1.0
+        else:
+            complexity = 1.2
+
+        # Расчет в зависимости от типа
+        if tattoo_type == 'filled':
+            price = filled_area * BASE_RATE_PER_CM2 * complexity
+        elif tattoo_type == 'mixed':
+            filled_price = filled_area * BASE_RATE_PER_CM2 * complexity
+            contour_price = perimeter * BASE_RATE_PER_CM * complexity
+            price = (filled_price + contour_price) / 2
+        else:  # outline
+            price = perimeter * BASE_RATE_PER_CM * complexity
+
+        # Умножаем на коэффициенты местоположения и цвета
+        price *= location_factor * color_factor
+
+        return max(int(price), MINIMAL_PRICE)
+
+    except Exception as e:
+        logger.error(f"Ошибка расчета цены: {e}")
+        return MINIMAL_PRICE
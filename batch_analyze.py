@@ -0,0 +1,231 @@
+"""Пакетный прогон анализа изображений для калибровки порогов
+
+Пример:
+    python batch_analyze.py refs/ -o results.csv --height 10 --location 1.5
+    python batch_analyze.py refs/ -o results_parquet --format parquet --resume
+
+Анализ тот же, что в боте (analysis.py), но без отладочных файлов. Работает на
+всех ядрах через пул процессов; результаты пишутся по мере готовности, поэтому
+прерванный прогон можно продолжить с --resume.
+"""
+import argparse
+import csv
+import logging
+import os
+import sys
+import time
+from functools import partial
+from multiprocessing import Pool
+
+import cv2
+from analysis import load_image, measure_pixels, areas_in_cm, calculate_price
+from config import COLOR_PRICING
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp', '.bmp'}
+
+COLUMNS = [
+    'path', 'width_px', 'height_px', 'filled_px', 'contour_px', 'perimeter_px',
+    'contours_count', 'fill_ratio', 'texture_std', 'tattoo_type',
+    'colors', 'colored_share', 'color_factor',
+    'height_cm', 'location_factor', 'filled_cm2', 'contour_cm2', 'perimeter_cm',
+    'price', 'seconds', 'error'
+]
+
+
+def find_images(root):
+    """Все изображения в каталоге (рекурсивно), пути относительно root"""
+    paths = []
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            if os.path.splitext(filename)[1].lower() in IMAGE_EXTENSIONS:
+                paths.append(os.path.relpath(os.path.join(dirpath, filename), root))
+    return sorted(paths)
+
+
+def init_worker():
+    # Параллелим процессами, внутренние потоки OpenCV только мешают
+    cv2.setNumThreads(1)
+
+
+def analyze_path(path, root, height_cm, location_factor):
+    """Анализ одного файла; ошибки попадают в колонку error, а не роняют прогон"""
+    row = dict.fromkeys(COLUMNS)
+    row.update(path=path, height_cm=height_cm, location_factor=location_factor)
+    started = time.perf_counter()
+    try:
+        metrics = measure_pixels(load_image(os.path.join(root, path)))
+        areas = areas_in_cm(metrics, height_cm)
+        row.update({
+            'width_px': metrics['width_px'],
+            'height_px': metrics['height_px'],
+            'filled_px': metrics['filled_px'],
+            'contour_px': metrics['contour_px'],
+            'perimeter_px': metrics['perimeter_px'],
+            'contours_count': metrics['contours_count'],
+            'fill_ratio': metrics['fill_ratio'],
+            'texture_std': metrics['texture_std'],
+            'tattoo_type': metrics['tattoo_type'],
+            'colors': metrics['colors'],
+            'colored_share': metrics['colored_share'],
+            'color_factor': metrics['color_factor'],
+            'filled_cm2': areas['filled'],
+            'contour_cm2': areas['contour'],
+            'perimeter_cm': areas['perimeter'],
+            'price': calculate_price(
+                filled_area=areas['filled'],
+                contour_area=areas['contour'],
+                perimeter=areas['perimeter'],
+                contours_count=metrics['contours_count'],
+                tattoo_type=metrics['tattoo_type'],
+                location_factor=location_factor,
+                color_factor=metrics['color_factor'] if COLOR_PRICING else 1.0
+            )
+        })
+    except Exception as e:
+        row['error'] = f"{type(e).__name__}: {e}"
+    row['seconds'] = round(time.perf_counter() - started, 4)
+    return row
+
+
+class CsvSink:
+    """Построчная запись в CSV с дописыванием при --resume"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def done_paths(self):
+        if not os.path.exists(self.path):
+            return set()
+        # Обрезаем строку, недописанную при прерывании
+        with open(self.path, 'rb+') as f:
+            data = f.read()
+            if data and not data.endswith(b'\n'):
+                f.truncate(data.rfind(b'\n') + 1)
+        with open(self.path, newline='', encoding='utf-8') as f:
+            return {row['path'] for row in csv.DictReader(f)}
+
+    def open(self, append):
+        new_file = not (append and os.path.exists(self.path) and os.path.getsize(self.path))
+        self._file = open(self.path, 'a' if append else 'w', newline='', encoding='utf-8')
+        self._writer = csv.DictWriter(self._file, fieldnames=COLUMNS)
+        if new_file:
+            self._writer.writeheader()
+
+    def write(self, row):
+        self._writer.writerow(row)
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetSink:
+    """Запись в каталог с частями part-NNNNN.parquet, по части на batch_size строк"""
+
+    def __init__(self, path, batch_size=1000):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            sys.exit("Для --format parquet нужен pyarrow: pip install pyarrow")
+        self._pa = pyarrow
+        self._pq = pyarrow.parquet
+        # Явная схема, иначе части с пустыми колонками получат тип null
+        types = {
+            'path': pyarrow.string(), 'tattoo_type': pyarrow.string(), 'error': pyarrow.string(),
+            'width_px': pyarrow.int64(), 'height_px': pyarrow.int64(),
+            'contours_count': pyarrow.int64(), 'colors': pyarrow.int64(), 'price': pyarrow.int64()
+        }
+        self.schema = pyarrow.schema([(name, types.get(name, pyarrow.float64())) for name in COLUMNS])
+        self.path = path
+        self.batch_size = batch_size
+        self._rows = []
+
+    def _parts(self):
+        if not os.path.isdir(self.path):
+            return []
+        return sorted(name for name in os.listdir(self.path) if name.endswith('.parquet'))
+
+    def done_paths(self):
+        done = set()
+        for name in self._parts():
+            table = self._pq.read_table(os.path.join(self.path, name), columns=['path'])
+            done.update(table.column('path').to_pylist())
+        return done
+
+    def open(self, append):
+        os.makedirs(self.path, exist_ok=True)
+        if not append:
+            for name in self._parts():
+                os.remove(os.path.join(self.path, name))
+        self._part = len(self._parts())
+
+    def write(self, row):
+        self._rows.append(row)
+        if len(self._rows) >= self.batch_size:
+            self._flush()
+
+    def _flush(self):
+        if not self._rows:
+            return
+        table = self._pa.Table.from_pylist(self._rows, schema=self.schema)
+        part_path = os.path.join(self.path, f"part-{self._part:05d}.parquet")
+        # Пишем во временный файл, чтобы при прерывании не осталось битой части
+        self._pq.write_table(table, f"{part_path}.tmp")
+        os.replace(f"{part_path}.tmp", part_path)
+        self._part += 1
+        self._rows = []
+
+    def close(self):
+        self._flush()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Пакетный анализ изображений тату")
+    parser.add_argument('images', help="каталог с изображениями")
+    parser.add_argument('-o', '--output', required=True, help="CSV-файл или каталог для Parquet")
+    parser.add_argument('--format', choices=('csv', 'parquet'), default='csv')
+    parser.add_argument('--height', type=float, default=10.0, help="высота тату в см для расчета цены")
+    parser.add_argument('--location', type=float, default=1.0, help="коэффициент местоположения")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="число процессов")
+    parser.add_argument('--chunksize', type=int, default=8, help="файлов на одну задачу пула")
+    parser.add_argument('--resume', action='store_true', help="пропустить уже обработанные файлы")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO)
+    args = parse_args(argv)
+    if args.height <= 0:
+        sys.exit("Высота должна быть больше 0.")
+
+    sink = CsvSink(args.output) if args.format == 'csv' else ParquetSink(args.output)
+    paths = find_images(args.images)
+    if args.resume:
+        done = sink.done_paths()
+        paths = [path for path in paths if path not in done]
+        logger.info(f"Уже обработано: {len(done)}")
+    logger.info(f"К обработке: {len(paths)} изображений, процессов: {args.workers}")
+
+    task = partial(analyze_path, root=args.images, height_cm=args.height, location_factor=args.location)
+    sink.open(append=args.resume)
+    started = time.perf_counter()
+    errors = 0
+    try:
+        with Pool(args.workers, initializer=init_worker) as pool:
+            for count, row in enumerate(pool.imap_unordered(task, paths, chunksize=args.chunksize), 1):
+                sink.write(row)
+                errors += row['error'] is not None
+                if count % 500 == 0:
+                    rate = count / (time.perf_counter() - started)
+                    logger.info(f"Обработано {count}/{len(paths)} ({rate:.1f} изобр./с), ошибок: {errors}")
+    finally:
+        sink.close()
+
+    logger.info(f"Готово за {time.perf_counter() - started:.1f} с, ошибок: {errors}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""Замер стоимости оценки цвета по сравнению с остальным анализом
+
+Пример:
+    python bench_color.py                 # синтетические картинки 1280x1280
+    python bench_color.py refs/ --runs 5  # свои изображения
+
+Бюджет на measure_colors - до ~20 мс на изображение.
+"""
+import argparse
+import os
+import statistics
+import time
+
+import cv2
+import numpy as np
+from analysis import load_image, measure_pixels, measure_colors
+from batch_analyze import find_images
+
+BUDGET_MS = 20
+
+
+def synthetic_images(count, side=1280, seed=0):
+    """Белый фон с черными контурами и цветными заливками"""
+    rng = np.random.default_rng(seed)
+    images = []
+    for _ in range(count):
+        image = np.full((side, side, 3), 255, np.uint8)
+        for _ in range(40):
+            center = tuple(int(v) for v in rng.integers(0, side, 2))
+            radius = int(rng.integers(side // 40, side // 6))
+            color = tuple(int(v) for v in rng.integers(0, 256, 3))
+            cv2.circle(image, center, radius, color, -1)
+            cv2.circle(image, center, radius, (0, 0, 0), 3)
+        images.append(image)
+    return images
+
+
+def median_ms(func, args, runs):
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        func(*args)
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк оценки цвета")
+    parser.add_argument('images', nargs='?', help="каталог с изображениями (по умолчанию синтетика)")
+    parser.add_argument('--count', type=int, default=10, help="синтетических изображений")
+    parser.add_argument('--runs', type=int, default=20, help="повторов на изображение")
+    args = parser.parse_args()
+
+    if args.images:
+        images = [load_image(os.path.join(args.images, path)) for path in find_images(args.images)]
+    else:
+        images = synthetic_images(args.count)
+
+    color_ms, total_ms = [], []
+    for image in images:
+        # Маску краски measure_colors получает готовой из measure_pixels
+        binary = measure_pixels(image)['binary']
+        color_ms.append(median_ms(measure_colors, (image, binary), args.runs))
+        total_ms.append(median_ms(measure_pixels, (image,), max(1, args.runs // 4)))
+
+    color_median = statistics.median(color_ms)
+    print(f"Изображений: {len(images)}")
+    print(f"measure_colors: медиана {color_median:.2f} мс, максимум {max(color_ms):.2f} мс")
+    print(f"measure_pixels целиком: медиана {statistics.median(total_ms):.1f} мс")
+    print(f"Доля цвета в анализе: {sum(color_ms) / sum(total_ms):.1%}")
+    print("OK" if max(color_ms) <= BUDGET_MS else f"Превышен бюджет {BUDGET_MS} мс")
+
+
+if __name__ == '__main__':
+    main()
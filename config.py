@@ -5,4 +5,47 @@ MASTER_CHAT_ID = "1408051569"  # ID мастера
 # Параметры стоимости
 BASE_RATE_PER_CM2 = 200  # руб/см² для заполненных тату
 BASE_RATE_PER_CM = 50    # руб/см для контурных тату
-MINIMAL_PRICE = 5000     # Минимальная стоимость
\ No newline at end of file
+MINIMAL_PRICE = 5000     # Минимальная стоимость
+
+# Параметры исходящей очереди запросов к Telegram
+OUTBOUND_GLOBAL_RATE = 25        # запросов в секунду на всего бота
+OUTBOUND_CHAT_RATE = 1.0         # сообщений в секунду в один чат
+OUTBOUND_CHAT_BURST = 3          # сколько сообщений в чат можно отправить подряд
+OUTBOUND_MAX_QUEUE = 500         # при большей очереди превью выбрасываются
+OUTBOUND_PREVIEW_MAX_WAIT = 30   # сек, после которых превью уже не нужно
+OUTBOUND_MAX_INFLIGHT_MEDIA = 2  # одновременных загрузок картинок
+OUTBOUND_METRICS_INTERVAL = 60   # сек между записями метрик в лог
+
+# Хранилище расчетов и заявок
+LEADS_DB_PATH = "tattoo_bot.sqlite3"
+LEADS_PAGE_SIZE = 10  # заявок на странице /leads
+
+# Накопительная статистика
+STATS_PATH = "tattoo_bot_stats.json"
+STATS_SAVE_INTERVAL = 60  # сек между сохранениями на диск
+
+# Сначала отправлять цену, а превью обработки догружать в фоне
+PROGRESSIVE_RESPONSE = True
+
+# Фоновый анализ изображения, пока пользователь отвечает на вопросы
+ANALYSIS_WORKERS = 2    # потоков для OpenCV
+SPECULATIVE_TTL = 600   # сек, после которых результат брошенной сессии выбрасывается
+DEBUG_IMAGES = True     # сохранять debug_original.png и debug_binary.png
+
+# Кнопки пересчета под результатом анализа
+HEIGHT_STEPS_CM = (-5, -1, 1, 5)  # шаги изменения высоты
+MIN_HEIGHT_CM = 1
+
+# Сторож event loop
+LOOP_LAG_INTERVAL = 0.1        # сек между замерами задержки
+LOOP_LAG_THRESHOLD = 0.25      # сек блокировки, после которых пишем стек в лог
+LOOP_LAG_WINDOW = 3000         # замеров для перцентилей (~5 минут)
+LOOP_LAG_REPORT_INTERVAL = 60  # сек между записями перцентилей в лог
+
+# Надбавка за цвет (расчет по изображению)
+COLOR_PRICING = False        # учитывать цвет в цене (включить после калибровки весов)
+COLOR_MIN_SHARE = 0.05       # меньшая доля цветной площади считается ч/б
+COLOR_SHARE_WEIGHT = 0.3     # надбавка за полностью цветную работу
+COLOR_PER_COLOR = 0.05       # надбавка за каждый цвет после первого
+COLOR_MAX_COLORS = 8         # больше цветов надбавку не увеличивает
+COLOR_MULTIPLIER_MAX = 1.6   # потолок коэффициента
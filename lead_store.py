@@ -0,0 +1,194 @@
+import json
+import logging
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Статусы расчета
+STATUS_QUOTED = 'quoted'      # пользователь получил цену
+STATUS_LEAD = 'lead'          # попросил связаться с мастером
+STATUS_DECLINED = 'declined'  # отказался
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS quotes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    quote_id TEXT NOT NULL UNIQUE,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    user_id INTEGER,
+    username TEXT,
+    first_name TEXT,
+    chat_id INTEGER,
+    calculation_type TEXT NOT NULL,
+    status TEXT NOT NULL,
+    price INTEGER,
+    tattoo_type TEXT,
+    location TEXT,
+    height_cm REAL,
+    image_area REAL,
+    contour_area REAL,
+    perimeter_cm REAL,
+    contours_count INTEGER,
+    answers TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_quotes_created_at ON quotes (created_at);
+CREATE INDEX IF NOT EXISTS idx_quotes_user ON quotes (user_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_quotes_status ON quotes (status, id);
+"""
+
+QUOTE_FIELDS = (
+    'quote_id', 'created_at', 'updated_at', 'user_id', 'username', 'first_name', 'chat_id',
+    'calculation_type', 'status', 'price', 'tattoo_type', 'location', 'height_cm',
+    'image_area', 'contour_area', 'perimeter_cm', 'contours_count', 'answers'
+)
+
+INSERT_SQL = (
+    f"INSERT OR IGNORE INTO quotes ({', '.join(QUOTE_FIELDS)}) "
+    f"VALUES ({', '.join('?' * len(QUOTE_FIELDS))})"
+)
+UPDATE_STATUS_SQL = "UPDATE quotes SET status = ?, updated_at = ? WHERE quote_id = ?"
+
+
+class LeadStore:
+    """Хранилище расчетов и заявок в SQLite
+
+    Запись идет пачками в отдельном потоке, чтобы не блокировать event loop.
+    Чтение (fetch_page) синхронное - из бота вызывать через asyncio.to_thread.
+    """
+
+    def __init__(self, path, batch_size=200, flush_interval=1.0):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue()
+        self._thread = None
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def start(self):
+        if self._thread is not None:
+            return
+        # Схему создаем сразу, чтобы чтение работало еще до первой записи
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+        conn.close()
+        self._thread = threading.Thread(target=self._writer, name="lead-store-writer", daemon=True)
+        self._thread.start()
+        logger.info(f"Хранилище заявок открыто: {self.path}")
+
+    def close(self):
+        """Дописать все из очереди и остановить поток записи"""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+
+    def add_quote(self, calculation_type, user=None, chat_id=None, **fields):
+        """Поставить расчет в очередь на запись, вернуть его quote_id"""
+        now = time.time()
+        answers = fields.get('answers')
+        row = {
+            'quote_id': uuid.uuid4().hex,
+            'created_at': now,
+            'updated_at': now,
+            'user_id': user.id if user else None,
+            'username': user.username if user else None,
+            'first_name': user.first_name if user else None,
+            'chat_id': chat_id,
+            'calculation_type': calculation_type,
+            'status': STATUS_QUOTED,
+            'price': fields.get('price'),
+            'tattoo_type': fields.get('tattoo_type'),
+            'location': fields.get('location'),
+            'height_cm': fields.get('height_cm'),
+            'image_area': fields.get('image_area'),
+            'contour_area': fields.get('contour_area'),
+            'perimeter_cm': fields.get('perimeter_cm'),
+            'contours_count': fields.get('contours_count'),
+            'answers': json.dumps(answers, ensure_ascii=False) if answers else None
+        }
+        self._queue.put((INSERT_SQL, tuple(row[field] for field in QUOTE_FIELDS)))
+        return row['quote_id']
+
+    def set_status(self, quote_id, status):
+        if quote_id:
+            self._queue.put((UPDATE_STATUS_SQL, (status, time.time(), quote_id)))
+
+    def update_quote(self, quote_id, **fields):
+        """Обновить поля расчета (например, цену после пересчета)"""
+        columns = [field for field in fields if field in QUOTE_FIELDS]
+        if not quote_id or not columns:
+            return
+        assignments = ', '.join(f"{column} = ?" for column in columns)
+        params = tuple(fields[column] for column in columns) + (time.time(), quote_id)
+        self._queue.put((f"UPDATE quotes SET {assignments}, updated_at = ? WHERE quote_id = ?", params))
+
+    def fetch_page(self, status=None, before_id=None, limit=10):
+        """Страница расчетов от новых к старым (keyset-пагинация по id)
+
+        before_id - id последней строки предыдущей страницы.
+        """
+        conditions, params = [], []
+        if status:
+            conditions.append("status = ?")
+            params.append(status)
+        if before_id:
+            conditions.append("id < ?")
+            params.append(before_id)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        params.append(limit)
+
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                f"SELECT * FROM quotes {where} ORDER BY id DESC LIMIT ?", params
+            ).fetchall()
+        finally:
+            conn.close()
+        return [dict(row) for row in rows]
+
+    def _writer(self):
+        conn = self._connect()
+        stopping = False
+        while not stopping:
+            op = self._queue.get()
+            if op is None:
+                break
+            batch = [op]
+
+            # Собираем пачку: до batch_size операций или flush_interval секунд
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    op = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if op is None:
+                    stopping = True
+                    break
+                batch.append(op)
+
+            self._write_batch(conn, batch)
+        conn.close()
+
+    def _write_batch(self, conn, batch):
+        try:
+            with conn:
+                for sql, params in batch:
+                    conn.execute(sql, params)
+            logger.debug(f"Записано в хранилище заявок: {len(batch)} операций")
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка записи в хранилище заявок: {e}", exc_info=True)
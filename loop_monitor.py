@@ -0,0 +1,155 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+
+from telegram.ext import ConversationHandler
+
+logger = logging.getLogger(__name__)
+
+
+class LoopLagMonitor:
+    """Сторож event loop: меряет задержку и ловит блокирующие вызовы
+
+    Задача в loop спит по interval и записывает, насколько проснулась позже.
+    Отдельный поток следит за ее пульсом: если loop молчит дольше threshold,
+    он снимает стек потока loop и пишет в лог, какой обработчик и какой
+    update сейчас выполняются.
+    """
+
+    def __init__(self, interval=0.1, threshold=0.25, window=3000, report_interval=60.0, stack_depth=12):
+        self.interval = interval
+        self.threshold = threshold
+        self.report_interval = report_interval
+        self.stack_depth = stack_depth
+        self._samples = deque(maxlen=window)
+        self._handler_codes = {}
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id = None
+        self._task = None
+        self._watchdog = None
+        self._stop = threading.Event()
+        self.stalls = 0
+
+    def register(self, *callbacks):
+        """Запомнить функции, которые надо называть в отчете о блокировке"""
+        for callback in callbacks:
+            code = getattr(callback, '__code__', None)
+            if code is not None:
+                self._handler_codes[code] = callback.__name__
+
+    def register_application(self, application):
+        """Зарегистрировать callback'и всех обработчиков, включая состояния диалогов"""
+        for handlers in application.handlers.values():
+            for handler in handlers:
+                if isinstance(handler, ConversationHandler):
+                    nested = list(handler.entry_points) + list(handler.fallbacks)
+                    for state_handlers in handler.states.values():
+                        nested.extend(state_handlers)
+                    self.register(*(h.callback for h in nested))
+                else:
+                    self.register(handler.callback)
+        for callback in application.error_handlers:
+            self.register(callback)
+
+    async def start(self):
+        if self._task is not None:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._run())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-lag-watchdog", daemon=True)
+        self._watchdog.start()
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._stop.set()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        await asyncio.to_thread(self._watchdog.join)
+        self._watchdog = None
+
+    def percentiles(self):
+        """p50/p90/p99/max задержки loop в мс по последним замерам"""
+        if not self._samples:
+            return {'p50': 0.0, 'p90': 0.0, 'p99': 0.0, 'max': 0.0, 'samples': 0, 'stalls': self.stalls}
+        ordered = sorted(self._samples)
+        last = len(ordered) - 1
+
+        def pick(q):
+            return round(ordered[int(last * q)] * 1000, 1)
+
+        return {
+            'p50': pick(0.5),
+            'p90': pick(0.9),
+            'p99': pick(0.99),
+            'max': round(ordered[-1] * 1000, 1),
+            'samples': len(ordered),
+            'stalls': self.stalls
+        }
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        last_report = loop.time()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            now = loop.time()
+            lag = max(0.0, now - expected)
+            self._samples.append(lag)
+            self._heartbeat = time.monotonic()
+
+            if lag > self.threshold:
+                logger.warning(f"Event loop был заблокирован на {lag * 1000:.0f} мс")
+            if now - last_report >= self.report_interval:
+                last_report = now
+                logger.info(f"Задержка event loop, мс: {self.percentiles()}")
+
+    def _watch(self):
+        reported = False
+        while not self._stop.wait(self.interval):
+            stalled = time.monotonic() - self._heartbeat - self.interval
+            if stalled > self.threshold:
+                # Сообщаем один раз за блокировку, пока loop не оживет
+                if not reported:
+                    reported = True
+                    self.stalls += 1
+                    self._report_stall(stalled)
+            else:
+                reported = False
+
+    def _report_stall(self, stalled):
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return
+
+        # Ближайший к месту блокировки зарегистрированный обработчик
+        handler, update = None, None
+        current = frame
+        while current is not None:
+            handler = self._handler_codes.get(current.f_code)
+            if handler:
+                update = current.f_locals.get('update')
+                break
+            current = current.f_back
+
+        update_info = "неизвестен"
+        if update is not None:
+            chat = getattr(update, 'effective_chat', None)
+            update_info = f"update_id={getattr(update, 'update_id', None)}, chat_id={chat.id if chat else None}"
+
+        stack = ''.join(traceback.format_stack(frame, limit=self.stack_depth))
+        logger.warning(
+            f"Event loop заблокирован уже {stalled * 1000:.0f} мс. "
+            f"Обработчик: {handler or 'неизвестен'}, update: {update_info}\n"
+            f"Стек потока loop:\n{stack}"
+        )
@@ -11,8 +11,26 @@ import numpy as np
 import sys
 import io
 import os
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from pprint import pformat
-from config import BOT_TOKEN, MASTER_CHAT_ID, BASE_RATE_PER_CM2, BASE_RATE_PER_CM, MINIMAL_PRICE
+from config import (
+    BOT_TOKEN, MASTER_CHAT_ID, MINIMAL_PRICE,
+    OUTBOUND_GLOBAL_RATE, OUTBOUND_CHAT_RATE, OUTBOUND_CHAT_BURST, OUTBOUND_MAX_QUEUE,
+    OUTBOUND_PREVIEW_MAX_WAIT, OUTBOUND_MAX_INFLIGHT_MEDIA, OUTBOUND_METRICS_INTERVAL,
+    LEADS_DB_PATH, LEADS_PAGE_SIZE, STATS_PATH, STATS_SAVE_INTERVAL, PROGRESSIVE_RESPONSE,
+    ANALYSIS_WORKERS, SPECULATIVE_TTL, HEIGHT_STEPS_CM, MIN_HEIGHT_CM,
+    LOOP_LAG_INTERVAL, LOOP_LAG_THRESHOLD, LOOP_LAG_WINDOW, LOOP_LAG_REPORT_INTERVAL,
+    COLOR_PRICING, DEBUG_IMAGES
+)
+from outbound import (
+    OutboundScheduler, PRIORITY_CALLBACK, PRIORITY_TEXT, PRIORITY_MEDIA, PRIORITY_PREVIEW
+)
+from lead_store import LeadStore, STATUS_LEAD, STATUS_DECLINED
+from quote_stats import QuoteStats
+from analysis import load_and_measure, areas_in_cm, calculate_price
+from loop_monitor import LoopLagMonitor
 
 # Установка UTF-8 как стандартной кодировки для вывода
 sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
@@ -30,6 +48,34 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)  # Дополнительная страховка
 
+# Все исходящие запросы к Telegram идут через общую очередь с приоритетами
+outbound = OutboundScheduler(
+    global_rate=OUTBOUND_GLOBAL_RATE,
+    chat_rate=OUTBOUND_CHAT_RATE,
+    chat_burst=OUTBOUND_CHAT_BURST,
+    max_queue=OUTBOUND_MAX_QUEUE,
+    preview_max_wait=OUTBOUND_PREVIEW_MAX_WAIT,
+    max_inflight_media=OUTBOUND_MAX_INFLIGHT_MEDIA,
+    metrics_interval=OUTBOUND_METRICS_INTERVAL
+)
+
+# Все расчеты и заявки сохраняются в SQLite
+lead_store = LeadStore(LEADS_DB_PATH)
+
+# Счетчики для /stats обновляются на каждом расчете
+quote_stats = QuoteStats(STATS_PATH, save_interval=STATS_SAVE_INTERVAL)
+
+# OpenCV отпускает GIL, поэтому анализ в потоках не блокирует event loop
+analysis_executor = ThreadPoolExecutor(max_workers=ANALYSIS_WORKERS, thread_name_prefix="analysis")
+
+# Следит, чтобы синхронный код в обработчиках не подвешивал все чаты
+loop_monitor = LoopLagMonitor(
+    interval=LOOP_LAG_INTERVAL,
+    threshold=LOOP_LAG_THRESHOLD,
+    window=LOOP_LAG_WINDOW,
+    report_interval=LOOP_LAG_REPORT_INTERVAL
+)
+
 # Состояния диалога
 (
     SELECT_ACTION, GET_IMAGE, GET_HEIGHT,
@@ -91,11 +137,16 @@ manual_questions = [
 
 async def start(update: Update, context: CallbackContext) -> int:
     """быстрое приключение на пять минут начинается здесь"""
+    # /start может прийти посреди диалога - начинаем с чистого листа, как restart
+    cancel_preview(context)
+    cancel_pixel_analysis(context)
+    context.user_data.clear()
     keyboard = [
         [InlineKeyboardButton("Загрузить картинку", callback_data='image')],
         [InlineKeyboardButton("Пройти тестик", callback_data='manual')]
     ]
-    await update.message.reply_text(
+    outbound.submit(
+        PRIORITY_TEXT, update.effective_chat.id, update.message.reply_text,
         "Привет! Я помогу рассчитать стоимость тату. Есть два варианта.\n"
         "Пройти тестик - тыкаем кнопки, выбираем параметры и считаем по ним.\n"
         "Загрузить изображение того, что примерно хочется и все (почти волшебно) посчитается.\n"
@@ -107,13 +158,14 @@ async def start(update: Update, context: CallbackContext) -> int:
 async def select_action(update: Update, context: CallbackContext) -> int:
     """поворот не туда"""
     query = update.callback_query
-    await query.answer()
+    outbound.submit(PRIORITY_CALLBACK, None, query.answer)
 
     if query.data == 'image':
-        await query.edit_message_text(text="Тут нужно отправить картинку того, что примерно хочется\n"
-                                           "Лучше всего - изображение на белом фоне\n"
-                                           "\n"
-                                           "Можно найти что-нибудь в пинтересте, на что мы будем ориентироваться сейчас. Посчитаем по нему, а потом Кварк создаст подобный эскиз!")
+        outbound.submit(PRIORITY_TEXT, query.message.chat_id, query.edit_message_text,
+                        text="Тут нужно отправить картинку того, что примерно хочется\n"
+                             "Лучше всего - изображение на белом фоне\n"
+                             "\n"
+                             "Можно найти что-нибудь в пинтересте, на что мы будем ориентироваться сейчас. Посчитаем по нему, а потом Кварк создаст подобный эскиз!")
         return GET_IMAGE
     else:
         context.user_data['calculation_type'] = 'manual'
@@ -135,16 +187,20 @@ async def ask_manual_question(update: Update, context: CallbackContext):
 
     try:
         # Пытаемся отправить вопрос с изображением
+        # Читаем в bytes, чтобы очередь могла повторить запрос после RetryAfter
         with open(f"images/{question['image']}", "rb") as photo:
-            await context.bot.send_photo(
-                chat_id=update.effective_chat.id,
-                photo=photo,
-                caption=question["text"],
-                reply_markup=InlineKeyboardMarkup(keyboard)
-            )
+            photo_bytes = photo.read()
+        outbound.submit(
+            PRIORITY_MEDIA, update.effective_chat.id, context.bot.send_photo,
+            chat_id=update.effective_chat.id,
+            photo=photo_bytes,
+            caption=question["text"],
+            reply_markup=InlineKeyboardMarkup(keyboard)
+        )
     except FileNotFoundError:
         # Если изображение не найдено, отправляем только текст
-        await context.bot.send_message(
+        outbound.submit(
+            PRIORITY_TEXT, update.effective_chat.id, context.bot.send_message,
             chat_id=update.effective_chat.id,
             text=question["text"],
             reply_markup=InlineKeyboardMarkup(keyboard)
@@ -155,7 +211,7 @@ async def ask_manual_question(update: Update, context: CallbackContext):
 async def handle_manual_answer(update: Update, context: CallbackContext) -> int:
     """Обработка ответа на вопрос ручного расчета"""
     query = update.callback_query
-    await query.answer()
+    outbound.submit(PRIORITY_CALLBACK, None, query.answer)
 
     try:
         # Разбираем callback_data: "ans_<question_index>_<option_index>"
@@ -194,14 +250,15 @@ async def handle_manual_answer(update: Update, context: CallbackContext) -> int:
 
     except Exception as e:
         logger.error(f"Ошибка обработки ответа: {str(e)}")
-        await query.edit_message_text("⚠️ Произошла ошибка. Пожалуйста, начните расчет заново.")
+        outbound.submit(PRIORITY_TEXT, query.message.chat_id, query.edit_message_text,
+                        "⚠️ Произошла ошибка. Пожалуйста, начните расчет заново.")
         return ConversationHandler.END
 
 
 async def finish_manual_calculation(update: Update, context: CallbackContext) -> int:
     """конец порнографии"""
     query = update.callback_query
-    await query.answer()
+    outbound.submit(PRIORITY_CALLBACK, None, query.answer)
 
     answers = context.user_data['answers']
 
@@ -216,12 +273,14 @@ async def finish_manual_calculation(update: Update, context: CallbackContext) ->
             [InlineKeyboardButton("Связаться с мастером", callback_data="contact_yes")],
             [InlineKeyboardButton("Отмена", callback_data="contact_no")]
         ]
+        context.user_data['price'] = None
     else:
         # Рассчитываем стоимость по формуле
         price = MINIMAL_PRICE
         for key in ['type', 'location', 'size', 'detail']:
             price *= answers[key]['value']
         price = int(price)
+        context.user_data['price'] = price
 
         message = (
             f"  Твои ответы:\n"
@@ -239,20 +298,33 @@ async def finish_manual_calculation(update: Update, context: CallbackContext) ->
             [InlineKeyboardButton("Нет", callback_data="contact_no")]
         ]
 
+    record_quote(update, context, 'manual')
+
+    # Ждать лимита чата в обработчике нельзя - правка уходит фоновой задачей
+    context.application.create_task(
+        edit_or_send(query, context, message, InlineKeyboardMarkup(keyboard)), update=update
+    )
+
+    return IMAGE_ANALYSIS_DONE
+
+
+async def edit_or_send(query, context: CallbackContext, text: str, reply_markup=None):
+    """Правка сообщения с кнопкой, а если не вышло (например, это фото) - новое сообщение"""
     try:
-        await query.edit_message_text(
-            text=message,
-            reply_markup=InlineKeyboardMarkup(keyboard)
+        await outbound.call(
+            PRIORITY_TEXT, query.message.chat_id, query.edit_message_text,
+            text=text,
+            reply_markup=reply_markup
         )
     except Exception as e:
         # logger.error(f"Ошибка при редактировании сообщения: {e}")
-        await context.bot.send_message(
+        await outbound.call(
+            PRIORITY_TEXT, query.message.chat_id, context.bot.send_message,
             chat_id=query.message.chat_id,
-            text=message,
-            reply_markup=InlineKeyboardMarkup(keyboard)
+            text=text,
+            reply_markup=reply_markup
         )
 
-    return IMAGE_ANALYSIS_DONE
 
 async def get_height(update: Update, context: CallbackContext) -> int:
     """Обработка введенной высоты"""
@@ -264,7 +336,8 @@ async def get_height(update: Update, context: CallbackContext) -> int:
         await ask_location_question(update, context)
         return IMAGE_QUESTION_LOCATION  # Используем новое состояние
     except ValueError:
-        await update.message.reply_text("Пожалуйста, введи число больше 0 (например, 10):")
+        outbound.submit(PRIORITY_TEXT, update.effective_chat.id, update.message.reply_text,
+                        "Пожалуйста, введи число больше 0 (например, 10):")
         return GET_HEIGHT
 
 
@@ -279,14 +352,17 @@ async def ask_location_question(update: Update, context: CallbackContext):
 
     try:
         with open(f"images/{location_question['image']}", "rb") as photo:
-            await context.bot.send_photo(
-                chat_id=update.effective_chat.id,
-                photo=photo,
-                caption=location_question["text"],
-                reply_markup=InlineKeyboardMarkup(keyboard)
-            )
+            photo_bytes = photo.read()
+        outbound.submit(
+            PRIORITY_MEDIA, update.effective_chat.id, context.bot.send_photo,
+            chat_id=update.effective_chat.id,
+            photo=photo_bytes,
+            caption=location_question["text"],
+            reply_markup=InlineKeyboardMarkup(keyboard)
+        )
     except FileNotFoundError:
-        await context.bot.send_message(
+        outbound.submit(
+            PRIORITY_TEXT, update.effective_chat.id, context.bot.send_message,
             chat_id=update.effective_chat.id,
             text=location_question["text"],
             reply_markup=InlineKeyboardMarkup(keyboard)
@@ -296,7 +372,7 @@ async def ask_location_question(update: Update, context: CallbackContext):
 async def handle_location_answer(update: Update, context: CallbackContext) -> int:
     """Обработка выбора местоположения для расчета по изображению"""
     query = update.callback_query
-    await query.answer()
+    outbound.submit(PRIORITY_CALLBACK, None, query.answer)
 
     try:
         option_index = int(query.data.split('_')[-1])
@@ -311,139 +387,243 @@ async def handle_location_answer(update: Update, context: CallbackContext) -> in
         return await analyze_image(update, context)
     except Exception as e:
         logger.error(f"Ошибка обработки местоположения: {e}")
-        await query.edit_message_text("Произошла ошибка. Пожалуйста, начни заново.")
+        outbound.submit(PRIORITY_TEXT, query.message.chat_id, query.edit_message_text,
+                        "Произошла ошибка. Пожалуйста, начни заново.")
         return ConversationHandler.END
 
 
 async def analyze_image(update: Update, context: CallbackContext) -> int:
     """Анализ изображения и расчет стоимости с учетом местоположения"""
+    started = time.perf_counter()
     try:
         # Получаем chat_id из callback_query или message
         chat_id = update.effective_chat.id
         query = update.callback_query
 
-        # Загрузка изображения из user_data
-        image_data = context.user_data['image']
-        image_pil = Image.open(image_data)
-        height_cm = context.user_data['height_cm']
-        location_factor = context.user_data['location']['value']
+        # Пиксельный анализ обычно уже посчитан в фоне после get_image
+        pixel_task = take_pixel_analysis(context.user_data)
+        if pixel_task is None or pixel_task.cancelled():
+            logger.debug(f"Фонового анализа для чата {chat_id} нет, считаем сейчас")
+            pixel_task = start_pixel_analysis(context, context.user_data['image'], keep=False)
+        image_np, metrics = await pixel_task
+
+        # Бинаризация, контуры и тип тату
+        binary = metrics['binary']
+        contours = metrics['contours']
+        tattoo_type = metrics['tattoo_type']
+
+        # Для пересчета цены храним только числа, без картинок и контуров
+        context.user_data['pixel_metrics'] = {
+            key: value for key, value in metrics.items() if key not in ('binary', 'contours')
+        }
+        price_image_quote(context.user_data)
+        record_quote(update, context, 'image')
+        report_message, keyboard = build_image_report(context.user_data)
+
+        # Отчет и превью уходят фоновой задачей: ожидание лимитов чата
+        # не должно задерживать обработку updates остальных чатов
+        cancel_preview(context)
+        context.user_data['preview_task'] = context.application.create_task(
+            deliver_image_report(
+                context.bot, chat_id, report_message, keyboard,
+                image_np, binary, contours, tattoo_type, started
+            ),
+            update=update
+        )
 
-        # Конвертация прозрачного фона в белый
-        if image_pil.mode == 'RGBA':
-            white_bg = Image.new('RGB', image_pil.size, (255, 255, 255))
-            white_bg.paste(image_pil, mask=image_pil.split()[3])
-            image_pil = white_bg
+        return IMAGE_ANALYSIS_DONE
 
-        image_np = np.array(image_pil)
+    except Exception as e:
+        logger.error(f"Ошибка анализа изображения: {str(e)}", exc_info=True)
+        outbound.submit(
+            PRIORITY_TEXT, update.effective_chat.id, context.bot.send_message,
+            chat_id=update.effective_chat.id,
+            text="Произошла ошибка при анализе. Попробуй другое изображение."
+        )
+        return SELECT_ACTION
 
-        # Сохранение оригинального изображения для отладки
-        cv2.imwrite("debug_original.png", cv2.cvtColor(image_np, cv2.COLOR_RGB2BGR))
 
-        # Предобработка изображения
-        gray = cv2.cvtColor(image_np, cv2.COLOR_RGB2GRAY)
-        gray = cv2.GaussianBlur(gray, (7, 7), 0)
+async def deliver_image_report(bot, chat_id: int, report_message: str, keyboard: InlineKeyboardMarkup,
+                               image_np: np.ndarray, binary: np.ndarray, contours, tattoo_type: str,
+                               started: float):
+    """Отправка отчета и превью; в прогрессивном режиме цена уходит первой"""
+    if not PROGRESSIVE_RESPONSE:
+        await send_processed_image(bot, chat_id, image_np, binary, contours, tattoo_type)
+    await outbound.call(
+        PRIORITY_TEXT, chat_id, bot.send_message,
+        chat_id=chat_id,
+        text=report_message,
+        reply_markup=keyboard,
+        parse_mode="Markdown"
+    )
 
-        # Бинаризация
-        _, th1 = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
-        th2 = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-                                  cv2.THRESH_BINARY_INV, 21, 10)
-        binary = cv2.bitwise_or(th1, th2)
-        binary = cv2.morphologyEx(binary, cv2.MORPH_CLOSE, np.ones((3, 3), np.uint8))
-        cv2.imwrite("debug_binary.png", binary)
+    time_to_price = time.perf_counter() - started
+    quote_stats.record_time_to_price(time_to_price)
+    logger.info(f"Время до цены для чата {chat_id}: {time_to_price:.2f} с")
+
+    if DEBUG_IMAGES:
+        # Отладочные файлы - уже после цены и не в потоке event loop
+        asyncio.get_running_loop().run_in_executor(analysis_executor, write_debug_images, image_np, binary)
+
+    if PROGRESSIVE_RESPONSE:
+        await send_processed_image(bot, chat_id, image_np, binary, contours, tattoo_type)
+
+
+def price_image_quote(user_data: dict) -> int:
+    """Площади и цена из пиксельных метрик, высоты и места - без повторного анализа"""
+    metrics = user_data['pixel_metrics']
+    areas = areas_in_cm(metrics, user_data['height_cm'])
+    price = calculate_price(
+        filled_area=areas['filled'],
+        contour_area=areas['contour'],
+        perimeter=areas['perimeter'],
+        contours_count=metrics['contours_count'],
+        tattoo_type=metrics['tattoo_type'],
+        location_factor=user_data['location']['value'],
+        color_factor=metrics['color_factor'] if COLOR_PRICING else 1.0
+    )
 
-        # Нахождение контуров
-        contours, _ = cv2.findContours(binary, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
-        if not contours:
-            raise ValueError("Не найдено контуров")
-
-        # Расчет параметров
-        px_per_cm = image_np.shape[0] / height_cm
-        areas = improved_calculate_areas(binary, contours, px_per_cm)
-
-        # Определение типа тату
-        tattoo_type = "outline"
-        if areas['filled'] > 0:
-            fill_ratio = areas['filled'] / (areas['contour'] + 1e-5)
-            roi_mask = np.zeros_like(gray)
-            cv2.drawContours(roi_mask, contours, -1, 255, cv2.FILLED)
-            texture_std = cv2.meanStdDev(gray, mask=roi_mask)[1][0][0]
-
-            if fill_ratio > 0.7 and texture_std < 30:
-                tattoo_type = "filled"
-            elif fill_ratio > 0.2 or texture_std > 30:
-                tattoo_type = "mixed"
-
-        contours_count = len(contours)
-
-        # Сохранение данных
-        context.user_data.update({
-            'image_area': areas['filled'],
-            'contour_area': areas['contour'],
-            'perimeter_cm': areas['perimeter'],
-            'contours_count': contours_count,
-            'tattoo_type': tattoo_type
-        })
-
-        # Расчет цены с учетом местоположения
-        price = calculate_price(
-            filled_area=areas['filled'],
-            contour_area=areas['contour'],
-            perimeter=areas['perimeter'],
-            contours_count=contours_count,
-            tattoo_type=tattoo_type,
-            location_factor=location_factor
-        )
-        context.user_data['price'] = price
+    # Сохранение данных
+    user_data.update({
+        'image_area': areas['filled'],
+        'contour_area': areas['contour'],
+        'perimeter_cm': areas['perimeter'],
+        'contours_count': metrics['contours_count'],
+        'tattoo_type': metrics['tattoo_type'],
+        'price': price
+    })
+    return price
+
+
+def image_report_keyboard(user_data: dict) -> InlineKeyboardMarkup:
+    """Кнопки под результатом: изменить высоту и место, связаться с мастером
+
+    В callback_data кнопок пересчета - quote_id, чтобы нажатие под старым
+    отчетом не правило текущий расчет.
+    """
+    quote_id = user_data['quote_id']
+    return InlineKeyboardMarkup([
+        [
+            InlineKeyboardButton(f"{delta:+d} см", callback_data=f"adj_h_{delta}_{quote_id}")
+            for delta in HEIGHT_STEPS_CM
+        ],
+        [InlineKeyboardButton(f"Место: {user_data['location']['label']}", callback_data=f"adj_locmenu_{quote_id}")],
+        [InlineKeyboardButton("Да", callback_data="contact_yes")],
+        [InlineKeyboardButton("Нет", callback_data="contact_no")]
+    ])
+
+
+def build_image_report(user_data: dict):
+    """Текст и кнопки отчета по изображению"""
+    type_names = {
+        'outline': 'Контурная',
+        'filled': 'Заполненная',
+        'mixed': 'Смешанная'
+    }
 
-        # Формирование отчета
-        type_names = {
-            'outline': 'Контурная',
-            'filled': 'Заполненная',
-            'mixed': 'Смешанная'
-        }
+    contours_count = user_data['contours_count']
+    complexity_level = (
+        "Низкая" if contours_count < 15 else
+        "Средняя" if contours_count < 1000 else
+        "Высокая"
+    )
 
-        complexity_level = (
-            "Низкая" if contours_count < 15 else
-            "Средняя" if contours_count < 1000 else
-            "Высокая"
-        )
+    metrics = user_data['pixel_metrics']
+    color_line = ""
+    if COLOR_PRICING and metrics['color_factor'] > 1:
+        color_line = f"▸ Цвет: {metrics['colors']} цв., {metrics['colored_share']:.0%} площади\n"
+
+    report_message = (
+        f"Результаты анализа:\n"
+        f"▸ Тип: {type_names.get(user_data['tattoo_type'], 'Неизвестный')}\n"
+        f"▸ Местоположение: {user_data['location']['label']}\n"
+        f"▸ Высота: {user_data['height_cm']:g} см\n"
+        f"▸ Площадь: {user_data['image_area']:.1f} см²\n"
+        f"▸ Периметр: {user_data['perimeter_cm']:.1f} см\n"
+        f"▸ Контуров: {contours_count} ({complexity_level} сложность)\n"
+        f"{color_line}"
+        f"  Приблизительная стоимость: {user_data['price']} ₽\n\n"
+        f"В случае, если стоимость вышла больше 30.000, скорее всего эта работа делается не за один сеанс.\n"
+        f"Если она делается не за один сеанс, то оплачивается не разово, а каждый сеанс отдельно - по 15000.\n\n"
+        f"Кнопками ниже можно поменять размер и место.\n"
+        f"Связаться с мастером?"
+    )
+    return report_message, image_report_keyboard(user_data)
 
-        report_message = (
-            f"Результаты анализа:\n"
-            f"▸ Тип: {type_names.get(tattoo_type, 'Неизвестный')}\n"
-            f"▸ Местоположение: {context.user_data['location']['label']}\n"
-            f"▸ Площадь: {areas['filled']:.1f} см²\n"
-            f"▸ Периметр: {areas['perimeter']:.1f} см\n"
-            f"▸ Контуров: {contours_count} ({complexity_level} сложность)\n"
-            f"  Приблизительная стоимость: {price} ₽\n\n"
-            f"В случае, если стоимость вышла больше 30.000, скорее всего эта работа делается не за один сеанс.\n"
-            f"Если она делается не за один сеанс, то оплачивается не разово, а каждый сеанс отдельно - по 15000.\n\n"
-            f"Связаться с мастером?"
-        )
 
-        keyboard = [
-            [InlineKeyboardButton("Да", callback_data="contact_yes")],
-            [InlineKeyboardButton("Нет", callback_data="contact_no")]
-        ]
+async def adjust_quote(update: Update, context: CallbackContext) -> int:
+    """Пересчет цены при смене высоты или места, сообщение правится на месте"""
+    query = update.callback_query
+    user_data = context.user_data
 
-        # Отправляем обработанное изображение и результаты
-        await send_processed_image(context.bot, chat_id, image_np, binary, contours, tattoo_type)
-        await context.bot.send_message(
-            chat_id=chat_id,
+    # Кнопки под отчетом, который уже сменился новым расчетом, ничего не трогают
+    action, quote_id = query.data.rsplit('_', 1)
+    if 'pixel_metrics' not in user_data or quote_id != user_data.get('quote_id'):
+        outbound.submit(PRIORITY_CALLBACK, None, query.answer,
+                        "Этот расчет уже неактуален. Новый можно начать с /start")
+        return IMAGE_ANALYSIS_DONE
+    outbound.submit(PRIORITY_CALLBACK, None, query.answer)
+
+    location_question = next(q for q in manual_questions if q["key"] == "location")
+    try:
+        if action == "adj_locmenu":
+            # Показываем список мест вместо кнопок под тем же сообщением
+            keyboard = [
+                [InlineKeyboardButton(text, callback_data=f"adj_loc_{idx}_{quote_id}")]
+                for idx, (text, _) in enumerate(location_question["options"])
+            ]
+            keyboard.append([InlineKeyboardButton("Назад", callback_data=f"adj_back_{quote_id}")])
+            outbound.submit(PRIORITY_TEXT, query.message.chat_id, query.edit_message_reply_markup,
+                            reply_markup=InlineKeyboardMarkup(keyboard))
+            return IMAGE_ANALYSIS_DONE
+
+        if action == "adj_back":
+            outbound.submit(PRIORITY_TEXT, query.message.chat_id, query.edit_message_reply_markup,
+                            reply_markup=image_report_keyboard(user_data))
+            return IMAGE_ANALYSIS_DONE
+
+        old_price, old_location = user_data['price'], user_data['location']['label']
+        if action.startswith("adj_loc_"):
+            option_text, option_value = location_question["options"][int(action.split('_')[-1])]
+            user_data['location'] = {
+                "value": option_value,
+                "label": option_text
+            }
+        else:
+            height_cm = user_data['height_cm'] + int(action.split('_')[-1])
+            # Ниже минимума не уменьшаем, но и меньшую введенную высоту не поднимаем
+            if height_cm < MIN_HEIGHT_CM:
+                return IMAGE_ANALYSIS_DONE
+            user_data['height_cm'] = height_cm
+
+        price_image_quote(user_data)
+        quote_stats.update_quote_price(
+            old_price, user_data['price'],
+            tattoo_type=user_data.get('tattoo_type'),
+            old_location=old_location,
+            new_location=user_data['location']['label']
+        )
+        lead_store.update_quote(
+            user_data.get('quote_id'),
+            price=user_data['price'],
+            location=user_data['location']['label'],
+            height_cm=user_data['height_cm'],
+            image_area=user_data['image_area'],
+            contour_area=user_data['contour_area'],
+            perimeter_cm=user_data['perimeter_cm']
+        )
+
+        report_message, keyboard = build_image_report(user_data)
+        outbound.submit(
+            PRIORITY_TEXT, query.message.chat_id, query.edit_message_text,
             text=report_message,
-            reply_markup=InlineKeyboardMarkup(keyboard),
+            reply_markup=keyboard,
             parse_mode="Markdown"
         )
-
-        return IMAGE_ANALYSIS_DONE
-
     except Exception as e:
-        logger.error(f"Ошибка анализа изображения: {str(e)}", exc_info=True)
-        await context.bot.send_message(
-            chat_id=update.effective_chat.id,
-            text="Произошла ошибка при анализе. Попробуй другое изображение."
-        )
-        return SELECT_ACTION
+        logger.error(f"Ошибка пересчета цены: {e}")
+
+    return IMAGE_ANALYSIS_DONE
 
 # async def get_height1(update: Update, context: CallbackContext) -> int:
 #     """Обработка введенной высоты и анализ изображения"""
@@ -582,22 +762,6 @@ async def analyze_image(update: Update, context: CallbackContext) -> int:
 #         return SELECT_ACTION
 
 
-def determine_tattoo_type(areas):
-    try:
-        if areas['filled'] < 1.0:  # Совсем маленькие области
-            return 'outline'
-
-        fill_ratio = areas['filled'] / (areas['contour'] + 1e-5)
-
-        if fill_ratio > 0.7:  # Больше заполнения
-            return 'filled'
-        elif fill_ratio > 0.3:  # Среднее заполнение
-            return 'mixed'
-        else:  # Чистые контуры
-            return 'outline'
-    except Exception as e:
-        # logger.error(f"Ошибка определения типа: {e}")
-        return 'outline'  # Значение по умолчанию
 async def get_image(update: Update, context: CallbackContext) -> int:
     """Обработка загруженного изображения"""
     try:
@@ -611,14 +775,19 @@ async def get_image(update: Update, context: CallbackContext) -> int:
         image_data.seek(0)
         context.user_data['image'] = image_data
 
-        await update.message.reply_text(
+        # Пиксели не зависят от высоты и места - начинаем считать, пока пользователь отвечает
+        start_pixel_analysis(context, image_data)
+
+        outbound.submit(
+            PRIORITY_TEXT, update.effective_chat.id, update.message.reply_text,
             "Изображение получено! Теперь укажи желаемую высоту тату в см (например, 10):"
         )
         return GET_HEIGHT
 
     except Exception as e:
         # logger.error(f"Ошибка загрузки фото: {e}")
-        await update.message.reply_text(
+        outbound.submit(
+            PRIORITY_TEXT, update.effective_chat.id, update.message.reply_text,
             "Не удалось обработать изображение. Пожалуйста, попробуй ещё раз или выбери другой файл."
         )
         return SELECT_ACTION
@@ -626,7 +795,14 @@ async def get_image(update: Update, context: CallbackContext) -> int:
 async def handle_contact_decision(update: Update, context: CallbackContext) -> int:
     """земля вызывает"""
     query = update.callback_query
-    await query.answer()
+    outbound.submit(PRIORITY_CALLBACK, None, query.answer)
+
+    lead_store.set_status(
+        context.user_data.get('quote_id'),
+        STATUS_LEAD if query.data == "contact_yes" else STATUS_DECLINED
+    )
+    if context.user_data.get('quote_id'):
+        quote_stats.record_decision(query.data == "contact_yes")
 
     if query.data == "contact_yes":
         user = query.from_user
@@ -660,23 +836,16 @@ async def handle_contact_decision(update: Update, context: CallbackContext) -> i
             f"🆔 ID: {user.id}\n"
             f"✉️ Имя: {user.first_name}"
         )
-        try:
-            await context.bot.send_message(chat_id=MASTER_CHAT_ID, text=message)
-            await query.edit_message_text("Запрос отправлен мастеру! Ожидай ответа.")
-        except Exception as e:
-            # logger.error(f"Ошибка отправки: {e}")
-            await query.edit_message_text("Что-то пошло не так и отправить запрос не получилось. Попробуй позже или не стесняйся и пиши сюда - @Kvarkovsky .")
+        context.application.create_task(send_lead_to_master(query, context, message), update=update)
 
         return ConversationHandler.END
     else:
-        # Удаляем предыдущее сообщение с кнопками
-        try:
-            await query.message.delete()
-        except Exception as e:
-            logger.error(f"Ошибка удаления сообщения: {e}")
+        # Удаляем предыдущее сообщение с кнопками (ошибку запишет очередь)
+        outbound.submit(PRIORITY_TEXT, query.message.chat_id, query.message.delete)
 
         # Отправляем новое сообщение с кнопкой
-        await context.bot.send_message(
+        outbound.submit(
+            PRIORITY_TEXT, query.message.chat.id, context.bot.send_message,
             chat_id=query.message.chat.id,
             text="Хорошо! Нажми кнопку ниже чтобы начать новый расчет:",
             reply_markup=InlineKeyboardMarkup([
@@ -685,128 +854,266 @@ async def handle_contact_decision(update: Update, context: CallbackContext) -> i
         )
         return IMAGE_ANALYSIS_DONE
 
+
+async def send_lead_to_master(query, context: CallbackContext, message: str):
+    """Отправка заявки мастеру и ответ пользователю (фоновая задача)"""
+    try:
+        await outbound.call(PRIORITY_TEXT, MASTER_CHAT_ID, context.bot.send_message,
+                            chat_id=MASTER_CHAT_ID, text=message)
+        await outbound.call(PRIORITY_TEXT, query.message.chat_id, query.edit_message_text,
+                            "Запрос отправлен мастеру! Ожидай ответа.")
+    except Exception as e:
+        # logger.error(f"Ошибка отправки: {e}")
+        await outbound.call(PRIORITY_TEXT, query.message.chat_id, query.edit_message_text,
+                            "Что-то пошло не так и отправить запрос не получилось. Попробуй позже или не стесняйся и пиши сюда - @Kvarkovsky .")
+
+
+def record_quote(update: Update, context: CallbackContext, calculation_type: str):
+    """Сохранение расчета в хранилище заявок и статистику"""
+    user_data = context.user_data
+    if calculation_type == 'manual':
+        # Пересчитывать по изображению больше нечего
+        user_data.pop('pixel_metrics', None)
+        answers = user_data['answers']
+        fields = {
+            'location': answers['location']['label'],
+            'answers': {key: answer['label'] for key, answer in answers.items()}
+        }
+    else:
+        fields = {
+            'tattoo_type': user_data.get('tattoo_type'),
+            'location': user_data['location']['label'],
+            'height_cm': user_data.get('height_cm'),
+            'image_area': user_data.get('image_area'),
+            'contour_area': user_data.get('contour_area'),
+            'perimeter_cm': user_data.get('perimeter_cm'),
+            'contours_count': user_data.get('contours_count')
+        }
+
+    user_data['quote_id'] = lead_store.add_quote(
+        calculation_type,
+        user=update.effective_user,
+        chat_id=update.effective_chat.id,
+        price=user_data.get('price'),
+        **fields
+    )
+    quote_stats.record_quote(
+        price=user_data.get('price'),
+        tattoo_type=fields.get('tattoo_type'),
+        location=fields['location'],
+        answers=fields.get('answers')
+    )
+
+
+def is_master(update: Update) -> bool:
+    return update.effective_chat is not None and str(update.effective_chat.id) == str(MASTER_CHAT_ID)
+
+
+def format_leads_page(rows, status):
+    """Текст и кнопки одной страницы /leads"""
+    status_names = {
+        'quoted': 'расчет',
+        'lead': 'заявка',
+        'declined': 'отказ'
+    }
+    title = "Заявки" if status else "Все расчеты"
+    status_key = status or 'all'
+    buttons = [InlineKeyboardButton("В начало", callback_data=f"leads_{status_key}_0")]
+    if not rows:
+        return f"{title}: больше ничего нет.", InlineKeyboardMarkup([buttons])
+
+    lines = [f"{title}:"]
+    for row in rows:
+        created = time.strftime('%d.%m.%Y %H:%M', time.localtime(row['created_at']))
+        price = f"{row['price']} ₽" if row['price'] is not None else "по оценке мастера"
+        details = ", ".join(
+            value for value in (row['calculation_type'], row['tattoo_type'], row['location']) if value
+        )
+        lines.append(
+            f"#{row['id']} {created} @{row['username'] or 'без_ника'} (ID {row['user_id']})\n"
+            f"  {price} - {details} [{status_names.get(row['status'], row['status'])}]"
+        )
+
+    if len(rows) == LEADS_PAGE_SIZE:
+        buttons.append(InlineKeyboardButton("Дальше", callback_data=f"leads_{status_key}_{rows[-1]['id']}"))
+    return "\n".join(lines), InlineKeyboardMarkup([buttons])
+
+
+async def leads(update: Update, context: CallbackContext) -> None:
+    """/leads - заявки для мастера, /leads all - все расчеты"""
+    if not is_master(update):
+        return
+
+    status = None if context.args and context.args[0] == 'all' else STATUS_LEAD
+    rows = await asyncio.to_thread(lead_store.fetch_page, status=status, limit=LEADS_PAGE_SIZE)
+    text, keyboard = format_leads_page(rows, status)
+    outbound.submit(PRIORITY_TEXT, update.effective_chat.id, update.message.reply_text,
+                    text, reply_markup=keyboard)
+
+
+async def leads_page(update: Update, context: CallbackContext) -> None:
+    """Листание /leads: callback_data "leads_<статус>_<id последней строки>"""
+    query = update.callback_query
+    outbound.submit(PRIORITY_CALLBACK, None, query.answer)
+    if not is_master(update):
+        return
+
+    _, status_key, before_id = query.data.split('_')
+    status = None if status_key == 'all' else status_key
+    rows = await asyncio.to_thread(
+        lead_store.fetch_page, status=status, before_id=int(before_id) or None, limit=LEADS_PAGE_SIZE
+    )
+    text, keyboard = format_leads_page(rows, status)
+    outbound.submit(PRIORITY_TEXT, query.message.chat_id, query.edit_message_text,
+                    text, reply_markup=keyboard)
+
+
+async def stats(update: Update, context: CallbackContext) -> None:
+    """/stats - статистика расчетов для мастера"""
+    if not is_master(update):
+        return
+
+    answer_titles = {question['key']: question['text'] for question in manual_questions}
+    outbound.submit(PRIORITY_TEXT, update.effective_chat.id, update.message.reply_text,
+                    quote_stats.summary(answer_titles=answer_titles))
+
+
+def write_debug_images(image_np: np.ndarray, binary: np.ndarray):
+    """Сохранение оригинала и бинаризации для отладки"""
+    try:
+        cv2.imwrite("debug_original.png", cv2.cvtColor(image_np, cv2.COLOR_RGB2BGR))
+        cv2.imwrite("debug_binary.png", binary)
+    except Exception as e:
+        logger.error(f"Ошибка сохранения отладочных изображений: {e}")
+
+
+def render_processed_image(image_np: np.ndarray, binary: np.ndarray, contours, tattoo_type: str) -> bytes:
+    """PNG с тремя панелями: оригинал, бинаризация, контуры"""
+    debug_img1 = cv2.cvtColor(binary, cv2.COLOR_GRAY2BGR)  # Бинаризация
+    debug_img2 = cv2.drawContours(image_np.copy(), contours, -1, (0, 255, 0), 2)  # Контуры
+    debug_image = np.hstack([image_np, debug_img1, debug_img2])
+    cv2.putText(debug_image, f"Type: {tattoo_type}", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
+
+    # Конвертируем для отправки
+    debug_image_pil = Image.fromarray(cv2.cvtColor(debug_image, cv2.COLOR_BGR2RGB))
+    img_byte_arr = io.BytesIO()
+    debug_image_pil.save(img_byte_arr, format='PNG')
+    return img_byte_arr.getvalue()
+
+
+def start_pixel_analysis(context: CallbackContext, image_data: io.BytesIO, keep: bool = True) -> asyncio.Future:
+    """Запуск пиксельного анализа в пуле потоков
+
+    keep=True - результат кладется в user_data и выбрасывается через SPECULATIVE_TTL,
+    если сессия брошена.
+    """
+    cancel_pixel_analysis(context)
+    loop = asyncio.get_running_loop()
+    # Каждому заданию свой BytesIO, чтобы потоки не делили позицию чтения
+    task = loop.run_in_executor(analysis_executor, load_and_measure, io.BytesIO(image_data.getvalue()))
+    if keep:
+        # Ошибку покажет analyze_image; здесь только чтобы asyncio не ругался на брошенный результат
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        context.user_data['pixel_task'] = task
+        context.user_data['pixel_task_timer'] = loop.call_later(
+            SPECULATIVE_TTL, discard_pixel_analysis, context.user_data, task
+        )
+    return task
+
+
+def take_pixel_analysis(user_data: dict):
+    """Забрать фоновый анализ из user_data и снять таймер его выброса"""
+    timer = user_data.pop('pixel_task_timer', None)
+    if timer is not None:
+        timer.cancel()
+    return user_data.pop('pixel_task', None)
+
+
+def cancel_pixel_analysis(context: CallbackContext):
+    task = take_pixel_analysis(context.user_data)
+    if task is not None and not task.done():
+        task.cancel()
+
+
+def discard_pixel_analysis(user_data: dict, task: asyncio.Future):
+    """Брошенная сессия: не держим в памяти результат, который никто не заберет"""
+    if user_data.get('pixel_task') is task:
+        del user_data['pixel_task']
+        user_data.pop('pixel_task_timer', None)
+        task.cancel()
+
+
+def cancel_preview(context: CallbackContext):
+    """Отмена фоновой отправки отчета и превью, если пользователь пошел дальше"""
+    task = context.user_data.pop('preview_task', None)
+    if task is not None and not task.done():
+        task.cancel()
+
+
+async def lag(update: Update, context: CallbackContext) -> None:
+    """/lag - задержка event loop и очередь исходящих для мастера"""
+    if not is_master(update):
+        return
+
+    percentiles = loop_monitor.percentiles()
+    queue_metrics = outbound.metrics()
+    message = (
+        f"Задержка event loop (последние {percentiles['samples']} замеров):\n"
+        f"▸ p50: {percentiles['p50']} мс\n"
+        f"▸ p90: {percentiles['p90']} мс\n"
+        f"▸ p99: {percentiles['p99']} мс\n"
+        f"▸ максимум: {percentiles['max']} мс\n"
+        f"▸ блокировок дольше {LOOP_LAG_THRESHOLD * 1000:.0f} мс: {percentiles['stalls']}\n\n"
+        f"Очередь исходящих: {sum(queue_metrics['queue_depth'].values())}, "
+        f"в полете: {queue_metrics['inflight']}"
+    )
+    outbound.submit(PRIORITY_TEXT, update.effective_chat.id, update.message.reply_text, message)
+
+
 async def send_processed_image(bot, chat_id: int, image_np: np.ndarray, binary: np.ndarray, contours, tattoo_type: str):
     """Отправка обработанного изображения с контурами и бинаризацией"""
     try:
-        # Создаем debug-изображение с тремя панелями
-        debug_img1 = cv2.cvtColor(binary, cv2.COLOR_GRAY2BGR)  # Бинаризация
-        debug_img2 = cv2.drawContours(image_np.copy(), contours, -1, (0, 255, 0), 2)  # Контуры
-        debug_image = np.hstack([image_np, debug_img1, debug_img2])
-        cv2.putText(debug_image, f"Type: {tattoo_type}", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
-
-        # Конвертируем для отправки
-        debug_image_pil = Image.fromarray(cv2.cvtColor(debug_image, cv2.COLOR_BGR2RGB))
-        img_byte_arr = io.BytesIO()
-        debug_image_pil.save(img_byte_arr, format='PNG')
-        img_byte_arr.seek(0)
-
-        await bot.send_photo(
+        # Рендер и PNG-кодирование - в отдельном потоке, чтобы не держать event loop
+        image_bytes = await asyncio.to_thread(render_processed_image, image_np, binary, contours, tattoo_type)
+
+        # Превью - самый низкий приоритет, при перегрузке очередь его выбросит
+        await outbound.call(
+            PRIORITY_PREVIEW, chat_id, bot.send_photo,
             chat_id=chat_id,
-            photo=img_byte_arr,
+            photo=image_bytes,
             caption="Результаты обработки:\n"
                     "1. Оригинал | 2. Бинаризация | 3. Контуры\n"
                     "Если контуры выглядят неточно, попробуй другое изображение."
         )
     except Exception as e:
         logger.error(f"Ошибка создания debug-изображения: {e}")
-        await bot.send_message(
+        await outbound.call(
+            PRIORITY_TEXT, chat_id, bot.send_message,
             chat_id=chat_id,
             text="Не удалось визуализировать процесс обработки."
         )
 
 
-def improved_calculate_areas(binary_image, contours, px_per_cm):
-    """Расчет площадей и периметра с учетом заливки"""
-    try:
-        # Площадь по залитым пикселям
-        filled_px = np.sum(binary_image == 255)
-        filled_cm2 = filled_px / (px_per_cm ** 2)
-
-        # Площадь по контурам (используем boundingRect для каждого контура)
-        contour_px = sum(w * h for (x, y, w, h) in
-                        [cv2.boundingRect(cnt) for cnt in contours])
-        contour_cm2 = contour_px / (px_per_cm ** 2)
-
-        # Периметр
-        perimeter = sum(cv2.arcLength(cnt, True) for cnt in contours) / px_per_cm
-
-        # logger.debug(
-        #     "Детальный расчет площадей:\n"
-        #     f"Всего пикселей: {binary_image.size}\n"
-        #     f"Заливка: {filled_px} px -> {filled_cm2:.2f} см²\n"
-        #     f"Контуры: {contour_px} px -> {contour_cm2:.2f} см²\n"
-        #     f"Соотношение: {filled_cm2 / (contour_cm2 + 1e-5):.2f}\n"
-        #     f"Пикселей на см: {px_per_cm:.1f}"
-        # )
-
-        return {
-            'filled': filled_cm2,
-            'contour': contour_cm2,
-            'perimeter': perimeter
-        }
-    except Exception as e:
-        # logger.error(f"Ошибка расчета площадей: {str(e)}", exc_info=True)
-        return {'filled': 0, 'contour': 0, 'perimeter': 0}
-
-
-def calculate_price(filled_area, contour_area, perimeter, contours_count, tattoo_type=None, location_factor=1.0):
-    """Расчет цены с учетом типа татуировки и местоположения"""
-    try:
-        # Если тип не указан, определяем автоматически
-        if tattoo_type is None:
-            tattoo_type = determine_tattoo_type({
-                'filled': filled_area,
-                'contour': contour_area
-            })
-
-        # Коэффициент сложности
-        if contours_count < 15:
-            complexity = 0.8
-        elif contours_count < 500:
-            complexity = 1.0
-        else:
-            complexity = 1.2
-
-        # Расчет в зависимости от типа
-        if tattoo_type == 'filled':
-            price = filled_area * BASE_RATE_PER_CM2 * complexity
-        elif tattoo_type == 'mixed':
-            filled_price = filled_area * BASE_RATE_PER_CM2 * complexity
-            contour_price = perimeter * BASE_RATE_PER_CM * complexity
-            price = (filled_price + contour_price) / 2
-        else:  # outline
-            price = perimeter * BASE_RATE_PER_CM * complexity
-
-        # Умножаем на коэффициент местоположения
-        price *= location_factor
-
-        return max(int(price), MINIMAL_PRICE)
-
-    except Exception as e:
-        logger.error(f"Ошибка расчета цены: {e}")
-        return MINIMAL_PRICE
-
-
 async def restart(update: Update, context: CallbackContext) -> int:
     """попытка номер пять"""
     query = update.callback_query
-    await query.answer()
+    outbound.submit(PRIORITY_CALLBACK, None, query.answer)
 
     # Очищаем данные
+    cancel_preview(context)
+    cancel_pixel_analysis(context)
     context.user_data.clear()
 
-    # Удаляем предыдущее сообщение
-    try:
-        await query.message.delete()
-    except Exception as e:
-        logger.error(f"Ошибка удаления сообщения: {e}")
+    # Удаляем предыдущее сообщение (ошибку запишет очередь)
+    outbound.submit(PRIORITY_TEXT, query.message.chat_id, query.message.delete)
 
     # Отправляем новое стартовое сообщение
     keyboard = [
         [InlineKeyboardButton("Оценить по изображению", callback_data='image')],
         [InlineKeyboardButton("Ручной расчет", callback_data='manual')]
     ]
-    await context.bot.send_message(
+    outbound.submit(
+        PRIORITY_TEXT, query.message.chat.id, context.bot.send_message,
         chat_id=query.message.chat.id,
         text="Привет! Я помогу рассчитать стоимость тату. Выбери способ:",
         reply_markup=InlineKeyboardMarkup(keyboard)
@@ -816,7 +1123,10 @@ async def restart(update: Update, context: CallbackContext) -> int:
 
 async def cancel(update: Update, context: CallbackContext) -> int:
     """галя отмена"""
-    await update.message.reply_text("До свидания! Если потребуется расчет - напиши /start")
+    cancel_preview(context)
+    cancel_pixel_analysis(context)
+    outbound.submit(PRIORITY_TEXT, update.effective_chat.id, update.message.reply_text,
+                    "До свидания! Если потребуется расчет - напиши /start")
     return ConversationHandler.END
 
 
@@ -827,17 +1137,41 @@ async def error_handler(update: object, context: CallbackContext) -> None:
     if update and isinstance(update, Update):
         chat_id = update.effective_chat.id if update.effective_chat else None
         if chat_id:
-            await context.bot.send_message(
+            outbound.submit(
+                PRIORITY_TEXT, chat_id, context.bot.send_message,
                 chat_id=chat_id,
                 text="Произошла ошибка. Пожалуйста, попробуй еще раз."
             )
 
+async def post_init(application: Application) -> None:
+    """Запуск фоновых служб после инициализации бота"""
+    await outbound.start()
+    await loop_monitor.start()
+    await asyncio.to_thread(lead_store.start)
+    await quote_stats.start()
+
+
+async def post_shutdown(application: Application) -> None:
+    """Остановка фоновых служб"""
+    await outbound.stop()
+    await asyncio.to_thread(lead_store.close)
+    await quote_stats.stop()
+    analysis_executor.shutdown(wait=False, cancel_futures=True)
+    await loop_monitor.stop()
+
+
 def main() -> None:
     import warnings
     from telegram.warnings import PTBUserWarning
     warnings.filterwarnings("ignore", category=PTBUserWarning)
     """с богом"""
-    application = Application.builder().token(BOT_TOKEN).build()
+    application = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
     application.add_error_handler(error_handler)
     conv_handler = ConversationHandler(
         entry_points=[CommandHandler('start', start)],
@@ -852,14 +1186,28 @@ def main() -> None:
             MANUAL_QUESTION_DETAIL: [CallbackQueryHandler(handle_manual_answer, pattern="^ans_3_")],
             IMAGE_ANALYSIS_DONE: [
                 CallbackQueryHandler(handle_contact_decision, pattern="^(contact_yes|contact_no)$"),
+                CallbackQueryHandler(adjust_quote, pattern="^adj_"),
                 CallbackQueryHandler(restart, pattern="^restart$")
             ]
         },
         fallbacks=[CommandHandler('cancel', cancel)],
-        per_chat=True
+        per_chat=True,
+        allow_reentry=True  # /start посреди диалога начинает его заново
     )
 
+    # Команды мастера регистрируем раньше диалога, иначе их перехватит select_action
+    application.add_handler(CommandHandler('leads', leads))
+    application.add_handler(CommandHandler('stats', stats))
+    application.add_handler(CommandHandler('lag', lag))
+    application.add_handler(CallbackQueryHandler(leads_page, pattern="^leads_"))
     application.add_handler(conv_handler)
+
+    # Чтобы в отчете о блокировке loop было имя обработчика, а не только стек
+    loop_monitor.register_application(application)
+    loop_monitor.register(
+        analyze_image, finish_manual_calculation, ask_manual_question,
+        ask_location_question, send_processed_image
+    )
     application.run_polling()
 
 if __name__ == '__main__':
@@ -0,0 +1,308 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+from telegram.error import RetryAfter
+
+logger = logging.getLogger(__name__)
+
+# Классы приоритета: чем меньше число, тем раньше уходит запрос
+PRIORITY_CALLBACK = 0  # ответы на нажатия кнопок
+PRIORITY_TEXT = 1      # текст расчета, вопросы, правки и удаление сообщений
+PRIORITY_MEDIA = 2     # картинки к вопросам
+PRIORITY_PREVIEW = 3   # превью обработки, выбрасывается при перегрузке
+
+PRIORITY_NAMES = {
+    PRIORITY_CALLBACK: 'callback',
+    PRIORITY_TEXT: 'text',
+    PRIORITY_MEDIA: 'media',
+    PRIORITY_PREVIEW: 'preview'
+}
+
+
+class TokenBucket:
+    """Ведро токенов: rate токенов в секунду, запас не больше burst"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now):
+        """Через сколько секунд появится токен (0 - уже есть)"""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def is_idle(self, now):
+        self._refill(now)
+        return self.tokens >= self.burst
+
+
+def _log_failure(future):
+    if not future.cancelled() and future.exception() is not None:
+        logger.error(f"Ошибка запроса к Telegram: {future.exception()}")
+
+
+class _Job:
+    __slots__ = ('priority', 'chat_id', 'func', 'args', 'kwargs', 'future', 'enqueued')
+
+    def __init__(self, priority, chat_id, func, args, kwargs, future):
+        self.priority = priority
+        self.chat_id = chat_id
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.future = future
+        self.enqueued = time.monotonic()
+
+
+class OutboundScheduler:
+    """Очередь исходящих запросов к Bot API с приоритетами и ограничением частоты
+
+    Общий лимит и лимит на чат считаются ведрами токенов. Превью (PRIORITY_PREVIEW)
+    выбрасываются, если очередь переполнена или они слишком долго ждали.
+    Пока планировщик не запущен, запросы выполняются сразу.
+    """
+
+    def __init__(self, global_rate=25, chat_rate=1.0, chat_burst=3, max_queue=500,
+                 preview_max_wait=30.0, max_inflight_media=2, metrics_interval=60.0):
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chat_rate = chat_rate
+        self._chat_burst = chat_burst
+        self._chat_buckets = {}
+        self._max_queue = max_queue
+        self._preview_max_wait = preview_max_wait
+        self._max_inflight_media = max_inflight_media
+        self._metrics_interval = metrics_interval
+
+        self._queues = {priority: deque() for priority in PRIORITY_NAMES}
+        self._inflight = set()
+        self._media_inflight = 0
+        self._paused_until = 0.0
+        self._wakeup = asyncio.Event()
+        self._worker = None
+        self._last_report = time.monotonic()
+
+        self.stats = {
+            name: {'submitted': 0, 'sent': 0, 'dropped': 0, 'retried': 0,
+                   'failed': 0, 'wait_total': 0.0, 'wait_max': 0.0}
+            for name in PRIORITY_NAMES.values()
+        }
+
+    async def start(self):
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run())
+            logger.info("Планировщик исходящих запросов запущен")
+
+    async def stop(self):
+        if self._worker is None:
+            return
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+
+        # Дожидаемся уже отправленных запросов, остальные отменяем
+        if self._inflight:
+            await asyncio.gather(*self._inflight, return_exceptions=True)
+        for queue in self._queues.values():
+            while queue:
+                queue.popleft().future.cancel()
+        logger.info(f"Планировщик исходящих запросов остановлен: {self.metrics()}")
+
+    def submit(self, priority, chat_id, func, *args, **kwargs):
+        """Поставить вызов func(*args, **kwargs) в очередь, не дожидаясь отправки
+
+        Обработчики должны пользоваться этим методом: PTB обрабатывает updates
+        по одному, и ожидание лимита одного чата задержало бы все остальные.
+        Ошибки запроса пишутся в лог.
+        """
+        future = self._enqueue(priority, chat_id, func, args, kwargs)
+        future.add_done_callback(_log_failure)
+        return future
+
+    async def call(self, priority, chat_id, func, *args, **kwargs):
+        """Поставить вызов в очередь и дождаться результата (для фоновых задач)
+
+        chat_id=None - запрос не расходует лимит чата (например, ответ на callback).
+        Для PRIORITY_PREVIEW возвращает None, если запрос был выброшен.
+        """
+        return await self._enqueue(priority, chat_id, func, args, kwargs)
+
+    def _enqueue(self, priority, chat_id, func, args, kwargs):
+        if self._worker is None:
+            return asyncio.ensure_future(func(*args, **kwargs))
+
+        future = asyncio.get_running_loop().create_future()
+        stats = self.stats[PRIORITY_NAMES[priority]]
+        stats['submitted'] += 1
+
+        if self.queue_depth() >= self._max_queue:
+            if priority == PRIORITY_PREVIEW:
+                stats['dropped'] += 1
+                logger.warning(f"Очередь переполнена, превью для чата {chat_id} выброшено")
+                future.set_result(None)
+                return future
+            self._evict_preview()
+
+        self._queues[priority].append(_Job(priority, chat_id, func, args, kwargs, future))
+        self._wakeup.set()
+        return future
+
+    def queue_depth(self):
+        return sum(len(queue) for queue in self._queues.values())
+
+    def metrics(self):
+        """Снимок метрик: глубина очередей, запросы в полете и счетчики по приоритетам"""
+        result = {
+            'queue_depth': {PRIORITY_NAMES[p]: len(q) for p, q in self._queues.items()},
+            'inflight': len(self._inflight),
+            'paused_for': round(max(0.0, self._paused_until - time.monotonic()), 1)
+        }
+        for name, stats in self.stats.items():
+            done = stats['sent'] + stats['failed']
+            result[name] = {
+                'submitted': stats['submitted'],
+                'sent': stats['sent'],
+                'dropped': stats['dropped'],
+                'retried': stats['retried'],
+                'failed': stats['failed'],
+                'wait_avg': round(stats['wait_total'] / done, 3) if done else 0.0,
+                'wait_max': round(stats['wait_max'], 3)
+            }
+        return result
+
+    def _evict_preview(self):
+        """Освобождаем место под важный запрос за счет самого старого превью"""
+        queue = self._queues[PRIORITY_PREVIEW]
+        while queue:
+            job = queue.popleft()
+            if job.future.done():
+                continue
+            self.stats['preview']['dropped'] += 1
+            job.future.set_result(None)
+            return
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(self._chat_rate, self._chat_burst)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    def _pick(self, now):
+        """Первый по приоритету запрос, чей чат не упирается в лимит
+
+        Возвращает (job, None) или (None, через сколько секунд проверить снова).
+        """
+        retry_in = None
+        for priority, queue in self._queues.items():
+            if priority == PRIORITY_PREVIEW:
+                while queue and now - queue[0].enqueued > self._preview_max_wait:
+                    job = queue.popleft()
+                    if not job.future.done():
+                        self.stats['preview']['dropped'] += 1
+                        job.future.set_result(None)
+
+            is_media = priority in (PRIORITY_MEDIA, PRIORITY_PREVIEW)
+            if is_media and self._media_inflight >= self._max_inflight_media:
+                continue
+
+            for index, job in enumerate(queue):
+                if job.future.done():
+                    # Вызывающий уже отменил ожидание
+                    del queue[index]
+                    return self._pick(now)
+                if job.chat_id is None:
+                    del queue[index]
+                    return job, None
+                delay = self._chat_bucket(job.chat_id).delay(now)
+                if delay == 0:
+                    del queue[index]
+                    return job, None
+                retry_in = delay if retry_in is None else min(retry_in, delay)
+        return None, retry_in
+
+    def _dispatch(self, job, now):
+        self._global.take(now)
+        if job.chat_id is not None:
+            self._chat_bucket(job.chat_id).take(now)
+        if job.priority in (PRIORITY_MEDIA, PRIORITY_PREVIEW):
+            self._media_inflight += 1
+
+        stats = self.stats[PRIORITY_NAMES[job.priority]]
+        waited = now - job.enqueued
+        stats['wait_total'] += waited
+        stats['wait_max'] = max(stats['wait_max'], waited)
+
+        task = asyncio.create_task(self._execute(job))
+        self._inflight.add(task)
+        task.add_done_callback(self._inflight.discard)
+
+    async def _execute(self, job):
+        stats = self.stats[PRIORITY_NAMES[job.priority]]
+        try:
+            result = await job.func(*job.args, **job.kwargs)
+        except RetryAfter as e:
+            # Telegram просит подождать - ставим на паузу всю очередь
+            stats['retried'] += 1
+            self._paused_until = max(self._paused_until, time.monotonic() + float(e.retry_after))
+            logger.warning(f"Telegram ограничил частоту, пауза {e.retry_after} с")
+            job.enqueued = time.monotonic()
+            self._queues[job.priority].appendleft(job)
+        except Exception as e:
+            stats['failed'] += 1
+            if not job.future.done():
+                job.future.set_exception(e)
+        else:
+            stats['sent'] += 1
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            if job.priority in (PRIORITY_MEDIA, PRIORITY_PREVIEW):
+                self._media_inflight -= 1
+            self._wakeup.set()
+
+    def _report(self, now):
+        if now - self._last_report < self._metrics_interval:
+            return
+        self._last_report = now
+
+        # Заодно забываем чаты, которые давно ничего не отправляли
+        for chat_id in [c for c, bucket in self._chat_buckets.items() if bucket.is_idle(now)]:
+            del self._chat_buckets[chat_id]
+
+        if any(stats['submitted'] for stats in self.stats.values()):
+            logger.info(f"Метрики исходящей очереди: {self.metrics()}")
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            self._report(now)
+
+            wait = max(self._paused_until - now, self._global.delay(now))
+            if wait <= 0:
+                job, wait = self._pick(now)
+                if job is not None:
+                    self._dispatch(job, now)
+                    continue
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=wait or self._metrics_interval)
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,191 @@
+import asyncio
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class QuoteStats:
+    """Накопительная статистика расчетов
+
+    Каждый расчет и решение пользователя обновляют счетчики за O(1),
+    поэтому /stats отвечает мгновенно при любой истории. Снимок периодически
+    сохраняется в JSON (запись файла - в отдельном потоке).
+    """
+
+    def __init__(self, path, save_interval=60.0):
+        self.path = path
+        self.save_interval = save_interval
+        self.data = self._empty()
+        self._dirty = False
+        self._task = None
+
+    @staticmethod
+    def _empty():
+        return {
+            'quotes': 0,
+            'leads': 0,
+            'declined': 0,
+            'daily': {},        # 'YYYY-MM-DD' -> {'quotes', 'leads', 'declined'}
+            'by_type': {},      # tattoo_type -> [кол-во, сумма цен]
+            'by_location': {},  # метка места -> [кол-во, сумма цен]
+            'answers': {},      # ключ вопроса -> {вариант: кол-во}
+            'time_to_price': [0, 0.0, 0.0]  # кол-во, сумма, максимум (сек)
+        }
+
+    def load(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                self.data.update(json.load(f))
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.error(f"Не удалось загрузить статистику: {e}")
+
+    def save(self, snapshot=None):
+        """Атомарная запись снимка на диск"""
+        if snapshot is None:
+            snapshot = json.dumps(self.data, ensure_ascii=False)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(snapshot)
+        os.replace(tmp_path, self.path)
+
+    def _day(self):
+        day = time.strftime('%Y-%m-%d')
+        counters = self.data['daily'].get(day)
+        if counters is None:
+            counters = self.data['daily'][day] = {'quotes': 0, 'leads': 0, 'declined': 0}
+        return counters
+
+    @staticmethod
+    def _add_price(groups, key, price):
+        group = groups.setdefault(key, [0, 0])
+        group[0] += 1
+        group[1] += price
+
+    @staticmethod
+    def _remove_price(groups, key, price):
+        group = groups.get(key)
+        if group is None:
+            return
+        group[0] -= 1
+        group[1] -= price
+        if group[0] <= 0:
+            del groups[key]
+
+    def record_quote(self, price=None, tattoo_type=None, location=None, answers=None):
+        """Учесть выданный расчет. answers - {ключ вопроса: выбранный вариант}"""
+        self.data['quotes'] += 1
+        self._day()['quotes'] += 1
+
+        if price is not None:
+            if tattoo_type:
+                self._add_price(self.data['by_type'], tattoo_type, price)
+            if location:
+                self._add_price(self.data['by_location'], location, price)
+
+        for key, label in (answers or {}).items():
+            distribution = self.data['answers'].setdefault(key, {})
+            distribution[label] = distribution.get(label, 0) + 1
+
+        self._dirty = True
+
+    def update_quote_price(self, old_price, new_price, tattoo_type=None, old_location=None, new_location=None):
+        """Пересчет выданного расчета: вклад старой цены заменяется новым"""
+        for groups, old_key, new_key in ((self.data['by_type'], tattoo_type, tattoo_type),
+                                         (self.data['by_location'], old_location, new_location)):
+            if old_price is not None and old_key:
+                self._remove_price(groups, old_key, old_price)
+            if new_price is not None and new_key:
+                self._add_price(groups, new_key, new_price)
+        self._dirty = True
+
+    def record_decision(self, contacted):
+        """Учесть ответ на "Связаться с мастером?" """
+        key = 'leads' if contacted else 'declined'
+        self.data[key] += 1
+        self._day()[key] += 1
+        self._dirty = True
+
+    def record_time_to_price(self, seconds):
+        """Учесть время от ответа пользователя до сообщения с ценой"""
+        latency = self.data['time_to_price']
+        latency[0] += 1
+        latency[1] += seconds
+        latency[2] = max(latency[2], seconds)
+        self._dirty = True
+
+    def summary(self, days=7, answer_titles=None):
+        """Текст для /stats. answer_titles - {ключ вопроса: формулировка}"""
+        data = self.data
+        quotes = data['quotes']
+        conversion = data['leads'] / quotes * 100 if quotes else 0.0
+
+        lines = [
+            "Статистика расчетов:",
+            f"▸ Всего расчетов: {quotes}",
+            f"▸ Заявок мастеру: {data['leads']} (конверсия {conversion:.1f}%)",
+            f"▸ Отказов: {data['declined']}",
+        ]
+        count, total, worst = data['time_to_price']
+        if count:
+            lines.append(f"▸ Время до цены: в среднем {total / count:.2f} с, максимум {worst:.2f} с")
+        lines += [
+            "",
+            f"По дням (последние {days}):"
+        ]
+        for day in sorted(data['daily'], reverse=True)[:days]:
+            counters = data['daily'][day]
+            lines.append(f"  {day}: расчетов {counters['quotes']}, заявок {counters['leads']}")
+
+        for title, groups in (("Средняя цена по типу:", data['by_type']),
+                              ("Средняя цена по месту:", data['by_location'])):
+            if groups:
+                lines.append("")
+                lines.append(title)
+                for key, (count, total) in sorted(groups.items(), key=lambda item: -item[1][0]):
+                    lines.append(f"  {key}: {int(total / count)} ₽ ({count} шт.)")
+
+        for key, distribution in data['answers'].items():
+            lines.append("")
+            lines.append((answer_titles or {}).get(key, key))
+            for label, count in sorted(distribution.items(), key=lambda item: -item[1]):
+                lines.append(f"  {label}: {count}")
+
+        return "\n".join(lines)
+
+    async def start(self):
+        if self._task is None:
+            await asyncio.to_thread(self.load)
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        await self._flush()
+
+    async def _flush(self):
+        if not self._dirty:
+            return
+        # Снимок берем в потоке event loop, пишем на диск - в отдельном
+        snapshot = json.dumps(self.data, ensure_ascii=False)
+        self._dirty = False
+        try:
+            await asyncio.to_thread(self.save, snapshot)
+        except OSError as e:
+            self._dirty = True
+            logger.error(f"Не удалось сохранить статистику: {e}")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.save_interval)
+            await self._flush()